@@ -1,25 +1,46 @@
 from collections.abc import AsyncGenerator
-from typing import IO
-
-from .page import Page
-from .parser import Parser
-
 from io import BytesIO
+from typing import IO, List
+
 from openpyxl import load_workbook
 
+from .page import Page
+from .parser import Parser
 
 
 class ExcelParser(Parser):
     """
-
+    Concrete parser that can parse Excel workbooks into Page objects. Each sheet becomes a Page object,
+    whose text is a (headers, columns) tuple of cell strings so the workbook can be closed before splitting.
     """
 
     async def parse(self, content: IO) -> AsyncGenerator[Page, None]:
-        blob_data = content
-        blob_stream = BytesIO(blob_data.read())
-        workbook = load_workbook(blob_stream, data_only=True)
-        
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            yield Page(page_num=sheet_name, offset=None, text=sheet)
- 
\ No newline at end of file
+        blob_stream = BytesIO(content.read())
+        workbook = load_workbook(blob_stream, read_only=True, data_only=True, keep_links=False)
+        try:
+            for sheet_name in workbook.sheetnames:
+                sheet = workbook[sheet_name]
+                yield Page(page_num=sheet_name, offset=None, text=self.read_sheet(sheet))
+        finally:
+            workbook.close()
+
+    def read_sheet(self, sheet):
+        """
+        Reads the headers and data of the given sheet in a single pass, converting empty cells to empty strings
+        and excluding empty rows. The data is stored column by column, with every column padded to the same length.
+        """
+        rows = sheet.iter_rows(values_only=True)
+        headers = ["" if value is None else str(value) for value in next(rows, ())]
+        columns: List[List[str]] = [[] for _ in headers]
+        num_rows = 0
+        for row in rows:
+            row_data = ["" if value is None else str(value) for value in row]
+            # Stops at the first non-blank cell instead of joining the whole row
+            if any(cell and not cell.isspace() for cell in row_data):
+                if len(row_data) > len(columns):
+                    columns.extend([""] * num_rows for _ in range(len(row_data) - len(columns)))
+                row_data.extend([""] * (len(columns) - len(row_data)))
+                for column, value in zip(columns, row_data):
+                    column.append(value)
+                num_rows += 1
+        return headers, columns
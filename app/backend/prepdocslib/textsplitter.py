@@ -1,11 +1,14 @@
+import bisect
+import functools
+import io
 import logging
+import os
+import re
 from abc import ABC
-from typing import Generator, List
+from typing import Generator, List, Optional, Tuple
 
 import tiktoken
 from tabulate import tabulate
-import pandas as pd
-
 
 from .page import Page, SplitPage
 
@@ -78,8 +81,28 @@ STANDARD_SENTENCE_ENDINGS = [".", "!", "?"]
 # https://www.w3.org/TR/jlreq/#cl-04
 CJK_SENTENCE_ENDINGS = ["。", "！", "？", "‼", "⁇", "⁈", "⁉"]
 
-# NB: text-embedding-3-XX is the same BPE as text-embedding-ada-002
-bpe = tiktoken.encoding_for_model(ENCODING_MODEL)
+SENTENCE_ENDINGS_SET = frozenset(STANDARD_SENTENCE_ENDINGS + CJK_SENTENCE_ENDINGS)
+
+# Regular expressions scan for boundaries in C instead of testing one character at a time in Python.
+# The greedy ".*" variants match up to the last boundary in the searched range.
+_SENTENCE_ENDINGS_CLASS = "[" + re.escape("".join(STANDARD_SENTENCE_ENDINGS + CJK_SENTENCE_ENDINGS)) + "]"
+_WORD_BREAKS_CLASS = "[" + re.escape("".join(STANDARD_WORD_BREAKS + CJK_WORD_BREAKS)) + "]"
+SENTENCE_RE = re.compile(_SENTENCE_ENDINGS_CLASS)
+LAST_SENTENCE_RE = re.compile(".*" + _SENTENCE_ENDINGS_CLASS, re.DOTALL)
+WORD_BREAK_RE = re.compile(_WORD_BREAKS_CLASS)
+LAST_WORD_BREAK_RE = re.compile(".*" + _WORD_BREAKS_CLASS, re.DOTALL)
+
+
+@functools.lru_cache(maxsize=1)
+def _bpe() -> tiktoken.Encoding:
+    # NB: text-embedding-3-XX is the same BPE as text-embedding-ada-002
+    # Loaded on first use, so that Excel-only pipelines never load (or download) the BPE ranks
+    return tiktoken.encoding_for_model(ENCODING_MODEL)
+
+
+def _count_tokens(text: str) -> int:
+    return len(_bpe().encode(text))
+
 
 DEFAULT_OVERLAP_PERCENT = 10  # See semantic search article for 10% overlap performance
 DEFAULT_SECTION_LENGTH = 1000  # Roughly 400-500 tokens for English
@@ -91,60 +114,74 @@ class SentenceTextSplitter(TextSplitter):
     """
 
     def __init__(self, max_tokens_per_section: int = 500):
-        self.sentence_endings = STANDARD_SENTENCE_ENDINGS + CJK_SENTENCE_ENDINGS
-        self.word_breaks = STANDARD_WORD_BREAKS + CJK_WORD_BREAKS
         self.max_section_length = DEFAULT_SECTION_LENGTH
         self.sentence_search_limit = 100
         self.max_tokens_per_section = max_tokens_per_section
         self.section_overlap = int(self.max_section_length * DEFAULT_OVERLAP_PERCENT / 100)
 
-    def split_page_by_max_tokens(self, page_num: int, text: str) -> Generator[SplitPage, None, None]:
+    def split_page_by_max_tokens(
+        self, page_num: int, text: str, token_count: Optional[int] = None
+    ) -> Generator[SplitPage, None, None]:
         """
-        Recursively splits page by maximum number of tokens to better handle languages with higher token/word ratios.
+        Repeatedly splits page by maximum number of tokens to better handle languages with higher token/word ratios.
+        Pass token_count when the number of tokens in text is already known, so that it is not encoded again.
         """
-        tokens = bpe.encode(text)
-        if len(tokens) <= self.max_tokens_per_section:
-            # Section is already within max tokens, return
-            yield SplitPage(page_num=page_num, text=text)
-        else:
-            # Start from the center and try and find the closest sentence ending by spiralling outward.
+        # Texts still to be split with their token counts if known, the next one in page order on top
+        stack: List[Tuple[str, Optional[int]]] = [(text, token_count)]
+        while stack:
+            text, token_count = stack.pop()
+            if token_count is not None:
+                within_limit = token_count <= self.max_tokens_per_section
+            else:
+                within_limit = self._fits_without_encoding(text) or _count_tokens(text) <= self.max_tokens_per_section
+            if within_limit:
+                # Section is already within max tokens, return
+                yield SplitPage(page_num=page_num, text=text)
+                continue
+
+            # Start from the center and try and find the closest sentence ending on either side of it,
+            # preferring the one before the center when both are equally close.
             # IF we get to the outer thirds, then just split in half with a 5% overlap
             start = int(len(text) // 2)
-            pos = 0
             boundary = int(len(text) // 3)
             split_position = -1
-            while start - pos > boundary:
-                if text[start - pos] in self.sentence_endings:
-                    split_position = start - pos
-                    break
-                elif text[start + pos] in self.sentence_endings:
-                    split_position = start + pos
-                    break
-                else:
-                    pos += 1
+            before = LAST_SENTENCE_RE.match(text, boundary + 1, start + 1)
+            after = SENTENCE_RE.search(text, start, 2 * start - boundary)
+            if before and (not after or start - (before.end() - 1) <= after.start() - start):
+                split_position = before.end() - 1
+            elif after:
+                split_position = after.start()
 
             if split_position > 0:
                 first_half = text[: split_position + 1]
                 second_half = text[split_position + 1 :]
             else:
-                # Split page in half and call function again
+                # Split page in half and split both halves again
                 # Overlap first and second halves by DEFAULT_OVERLAP_PERCENT%
                 middle = int(len(text) // 2)
                 overlap = int(len(text) * (DEFAULT_OVERLAP_PERCENT / 100))
                 first_half = text[: middle + overlap]
                 second_half = text[middle - overlap :]
-            yield from self.split_page_by_max_tokens(page_num, first_half)
-            yield from self.split_page_by_max_tokens(page_num, second_half)
+            stack.append((second_half, None))
+            stack.append((first_half, None))
+
+    def _fits_without_encoding(self, text: str) -> bool:
+        # Every token is at least one UTF-8 byte, so a text with no more bytes than max tokens is within the limit.
+        # Non-ASCII characters can take several tokens each, which is why this counts bytes rather than characters.
+        if len(text) > self.max_tokens_per_section:
+            return False
+        return text.isascii() or len(text.encode("utf-8")) <= self.max_tokens_per_section
 
     def split_pages(self, pages: List[Page]) -> Generator[SplitPage, None, None]:
+        offsets = [page.offset for page in pages]
+        page_nums = [page.page_num for page in pages]
+
         def find_page(offset):
-            num_pages = len(pages)
-            for i in range(num_pages - 1):
-                if offset >= pages[i].offset and offset < pages[i + 1].offset:
-                    return pages[i].page_num
-            return pages[num_pages - 1].page_num
+            # Page offsets are in ascending order, so the page is the last one starting at or before the offset
+            return page_nums[bisect.bisect_right(offsets, offset) - 1]
 
-        all_text = "".join(page.text for page in pages)
+        # A list lets join size the result up front, unlike a generator
+        all_text = "".join([page.text for page in pages])
         if len(all_text.strip()) == 0:
             return
 
@@ -153,50 +190,67 @@ class SentenceTextSplitter(TextSplitter):
             yield from self.split_page_by_max_tokens(page_num=find_page(0), text=all_text)
             return
 
+        # Find all the sections first so that they can be tokenized in a single batch
+        sections = [
+            (find_page(start), all_text[start:end]) for start, end in self.find_section_spans(all_text, find_page)
+        ]
+        token_counts = [
+            len(tokens)
+            for tokens in _bpe().encode_batch([text for _, text in sections], num_threads=os.cpu_count() or 8)
+        ]
+        for (page_num, section_text), token_count in zip(sections, token_counts):
+            if token_count <= self.max_tokens_per_section:
+                yield SplitPage(page_num=page_num, text=section_text)
+            else:
+                yield from self.split_page_by_max_tokens(page_num=page_num, text=section_text, token_count=token_count)
+
+    def find_section_spans(self, all_text: str, find_page) -> Generator[Tuple[int, int], None, None]:
+        """
+        Finds the (start, end) offsets of the overlapping sections of the text, ending sections at sentence endings or
+        at least at word breaks, without tokenizing them.
+        """
+        length = len(all_text)
         start = 0
         end = length
         while start + self.section_overlap < length:
-            last_word = -1
             end = start + self.max_section_length
 
             if end > length:
                 end = length
             else:
                 # Try to find the end of the sentence
-                while (
-                    end < length
-                    and (end - start - self.max_section_length) < self.sentence_search_limit
-                    and all_text[end] not in self.sentence_endings
-                ):
-                    if all_text[end] in self.word_breaks:
-                        last_word = end
-                    end += 1
-                if end < length and all_text[end] not in self.sentence_endings and last_word > 0:
-                    end = last_word  # Fall back to at least keeping a whole word
+                search_end = min(length, start + self.max_section_length + self.sentence_search_limit)
+                sentence_match = SENTENCE_RE.search(all_text, end, search_end)
+                if sentence_match:
+                    end = sentence_match.start()
+                else:
+                    word_match = LAST_WORD_BREAK_RE.match(all_text, end, search_end)
+                    end = search_end
+                    if end < length and all_text[end] not in SENTENCE_ENDINGS_SET and word_match:
+                        end = word_match.end() - 1  # Fall back to at least keeping a whole word
             if end < length:
                 end += 1
 
             # Try to find the start of the sentence or at least a whole word boundary
-            last_word = -1
-            while (
-                start > 0
-                and start > end - self.max_section_length - 2 * self.sentence_search_limit
-                and all_text[start] not in self.sentence_endings
-            ):
-                if all_text[start] in self.word_breaks:
-                    last_word = start
-                start -= 1
-            if all_text[start] not in self.sentence_endings and last_word > 0:
-                start = last_word
+            search_start = max(0, end - self.max_section_length - 2 * self.sentence_search_limit)
+            sentence_match = LAST_SENTENCE_RE.match(all_text, search_start + 1, start + 1)
+            if sentence_match:
+                start = sentence_match.end() - 1
+            else:
+                word_match = WORD_BREAK_RE.search(all_text, search_start + 1, start + 1)
+                start = min(start, search_start)
+                if all_text[start] not in SENTENCE_ENDINGS_SET and word_match:
+                    start = word_match.start()
             if start > 0:
                 start += 1
 
-            section_text = all_text[start:end]
-            yield from self.split_page_by_max_tokens(page_num=find_page(start), text=section_text)
+            yield start, end
 
-            last_figure_start = section_text.rfind("<figure")
-            if last_figure_start > 2 * self.sentence_search_limit and last_figure_start > section_text.rfind(
-                "</figure"
+            # Search within the section bounds rather than slicing out the section text again
+            last_figure_start = all_text.rfind("<figure", start, end) - start
+            if (
+                last_figure_start > 2 * self.sentence_search_limit
+                and last_figure_start > all_text.rfind("</figure", start, end) - start
             ):
                 # If the section ends with an unclosed figure, we need to start the next section with the figure.
                 start = min(end - self.section_overlap, start + last_figure_start)
@@ -207,7 +261,7 @@ class SentenceTextSplitter(TextSplitter):
                 start = end - self.section_overlap
 
         if start + self.section_overlap < end:
-            yield from self.split_page_by_max_tokens(page_num=find_page(start), text=all_text[start:end])
+            yield start, end
 
 
 class SimpleTextSplitter(TextSplitter):
@@ -220,18 +274,28 @@ class SimpleTextSplitter(TextSplitter):
         self.max_object_length = max_object_length
 
     def split_pages(self, pages: List[Page]) -> Generator[SplitPage, None, None]:
-        all_text = "".join(page.text for page in pages)
-        if len(all_text.strip()) == 0:
+        if all(page.text == "" or page.text.isspace() for page in pages):
             return
 
-        length = len(all_text)
+        length = sum(len(page.text) for page in pages)
         if length <= self.max_object_length:
-            yield SplitPage(page_num=0, text=all_text)
+            yield SplitPage(page_num=0, text="".join([page.text for page in pages]))
             return
 
         # its too big, so we need to split it
-        for i in range(0, length, self.max_object_length):
-            yield SplitPage(page_num=i // self.max_object_length, text=all_text[i : i + self.max_object_length])
+        # Chunks are cut page by page, carrying the leftover text of each page over to the next one,
+        # so the text of all pages is never joined into a single string
+        chunk_num = 0
+        remainder = ""
+        for page in pages:
+            text = remainder + page.text
+            chunked_length = len(text) - len(text) % self.max_object_length
+            for i in range(0, chunked_length, self.max_object_length):
+                yield SplitPage(page_num=chunk_num, text=text[i : i + self.max_object_length])
+                chunk_num += 1
+            remainder = text[chunked_length:]
+        if remainder:
+            yield SplitPage(page_num=chunk_num, text=remainder)
         return
 
 
@@ -241,24 +305,33 @@ class SimpleTextSplitter(TextSplitter):
 
 
 class ExcelSplitter(TextSplitter):
+    """
+    Class that splits Excel sheets into Markdown tables of at most 50 rows each, repeating the headers in every table.
+    Set use_tabulate to render the tables with tabulate instead of the built-in Markdown formatter.
+    """
+
+    def __init__(self, use_tabulate: bool = False):
+        self.use_tabulate = use_tabulate
 
     def split_pages(self, pages):
-        for sheet_page in pages:        
-            sheet = sheet_page.text
-            data, headers = self.get_sheet_data(sheet)
-            rows = data
-            step = 50
-            for start_row in range(0, len(rows), step):
-                chunk_rows = rows[start_row:start_row + step]
-                # Convert NaN values to empty strings
-                chunk_rows = [[str(cell) if pd.notna(cell) else '' for cell in row] for row in chunk_rows]
-            # print(data, headers)
-            # table = tabulate(data, headers=headers, tablefmt="grid")
-                table = tabulate([headers] + chunk_rows, headers="firstrow", tablefmt="grid")
-                table = self.clean_markdown_table(table)
-                yield SplitPage(page_num=sheet_page.page_num, text=table)
+        for sheet_page in pages:
+            columns, headers = self.get_sheet_data(sheet_page.text)
+            for chunk_columns in self._iter_chunks(columns):
+                yield SplitPage(page_num=sheet_page.page_num, text=self._render_chunk(headers, chunk_columns))
         return
 
+    def _iter_chunks(self, columns, step=50):
+        # Cells are already strings, get_sheet_data converts empty cells to empty strings
+        num_rows = len(columns[0]) if columns else 0
+        for start_row in range(0, num_rows, step):
+            yield [column[start_row : start_row + step] for column in columns]
+
+    def _render_chunk(self, headers, columns):
+        if self.use_tabulate:
+            chunk_rows = list(zip(*columns))
+            return self.clean_markdown_table(tabulate(chunk_rows, headers=headers, tablefmt="grid"))
+        return self._format_markdown_table(headers, columns)
+
     # def split_pages(self, pages):
     #     for sheet_page in pages:        
     #         sheet = sheet_page.text
@@ -274,28 +347,46 @@ class ExcelSplitter(TextSplitter):
         
     def get_sheet_data(self, sheet):
         """
-        Retrieves data and headers from the given sheet. Each row's data is processed into a list format, ensuring that empty rows are excluded.
+        Retrieves data and headers from the given sheet. The data is returned column by column, ensuring that empty rows are excluded.
 
         Args:
-            sheet (Worksheet): The worksheet object to extract data from.
+            sheet (Tuple[List[str], List[List[str]]]): The (headers, columns) tuple read by ExcelParser.
 
         Returns:
-            Tuple[List[List[str]], List[str]]: A tuple containing a list of row data and a list of headers.
+            Tuple[List[List[str]], List[str]]: A tuple containing a list of column data and a list of headers.
+        """
+        headers, columns = sheet
+        return columns, headers
+
+    def _format_markdown_table(self, headers, columns):
         """
-        data = []
-        for row in sheet.iter_rows(min_row=2):  # Start from the second row to skip headers
-            row_data = []
-            for cell in row:
-                cell_value = cell.value
-                if cell_value is None:
-                    cell_value = ""
-                cell_text = str(cell_value)
-                row_data.append(cell_text)
-            if "".join(row_data).strip() != "":
-                data.append(row_data)
-        headers = [cell.value if cell.value is not None else "" for cell in sheet[1]]
-        return data, headers
-    
+        Formats the headers and columns as a Markdown table in a single pass, without any padding inside the cells.
+
+        Args:
+            headers (List[str]): The header cells.
+            columns (List[List[str]]): The data columns, all of the same length. There may be fewer or more columns than headers.
+
+        Returns:
+            str: The Markdown table string.
+        """
+        num_columns = max(len(headers), len(columns))
+        num_rows = len(columns[0]) if columns else 0
+        header_cells = [self._format_markdown_cell(header) for header in headers]
+        header_cells.extend([""] * (num_columns - len(header_cells)))
+        cell_columns = [[self._format_markdown_cell(cell) for cell in column] for column in columns]
+        cell_columns.extend([[""] * num_rows for _ in range(num_columns - len(cell_columns))])
+        buffer = io.StringIO()
+        buffer.write("| " + " | ".join(header_cells) + " |\n")
+        # Cells are not padded, so the separator does not need to match the column widths
+        buffer.write("| " + " | ".join(["---"] * num_columns) + " |")
+        for row in zip(*cell_columns):
+            buffer.write("\n| " + " | ".join(row) + " |")
+        return buffer.getvalue()
+
+    def _format_markdown_cell(self, cell):
+        # Cells may span several lines or contain pipes, neither of which fits in a Markdown table cell
+        return " ".join(str(cell).split()).replace("|", "\\|")
+
     def clean_markdown_table(self, table_str):
         """
         Cleans up a Markdown table string by removing excessive whitespace from each cell.
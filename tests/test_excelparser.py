@@ -0,0 +1,66 @@
+import io
+
+import pytest
+from openpyxl import Workbook
+
+from prepdocslib.excelparser import ExcelParser
+
+
+def create_workbook_file(sheets):
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for sheet_name, rows in sheets.items():
+        sheet = workbook.create_sheet(sheet_name)
+        for row in rows:
+            sheet.append(row)
+    file = io.BytesIO()
+    workbook.save(file)
+    file.seek(0)
+    file.name = "test.xlsx"
+    return file
+
+
+@pytest.mark.asyncio
+async def test_excelparser_single_sheet():
+    file = create_workbook_file({"Sheet1": [["Name", "Age"], ["Alice", 30], ["Bob", None]]})
+    parser = ExcelParser()
+
+    pages = [page async for page in parser.parse(file)]
+
+    assert len(pages) == 1
+    assert pages[0].page_num == "Sheet1"
+    assert pages[0].offset is None
+    assert pages[0].text == (["Name", "Age"], [["Alice", "Bob"], ["30", ""]])
+
+
+@pytest.mark.asyncio
+async def test_excelparser_skips_empty_rows():
+    file = create_workbook_file({"Sheet1": [["Name", "Age"], ["Alice", 30], [None, None], [" ", ""], ["Bob", 40]]})
+    parser = ExcelParser()
+
+    pages = [page async for page in parser.parse(file)]
+
+    assert pages[0].text == (["Name", "Age"], [["Alice", "Bob"], ["30", "40"]])
+
+
+@pytest.mark.asyncio
+async def test_excelparser_multiple_sheets():
+    file = create_workbook_file({"First": [["a"], [1]], "Second": [["b"], [2]], "Empty": []})
+    parser = ExcelParser()
+
+    pages = [page async for page in parser.parse(file)]
+
+    assert [page.page_num for page in pages] == ["First", "Second", "Empty"]
+    assert pages[0].text == (["a"], [["1"]])
+    assert pages[1].text == (["b"], [["2"]])
+    assert pages[2].text == ([], [])
+
+
+@pytest.mark.asyncio
+async def test_excelparser_pads_columns():
+    file = create_workbook_file({"Sheet1": [["a", "b", "c"], [1], [2, None, 3, 4]]})
+    parser = ExcelParser()
+
+    pages = [page async for page in parser.parse(file)]
+
+    assert pages[0].text == (["a", "b", "c", ""], [["1", "2"], ["", ""], ["", "3"], ["", "4"]])
@@ -11,6 +11,7 @@ from prepdocslib.pdfparser import LocalPdfParser
 from prepdocslib.searchmanager import Section
 from prepdocslib.textsplitter import (
     ENCODING_MODEL,
+    ExcelSplitter,
     SentenceTextSplitter,
     SimpleTextSplitter,
 )
@@ -186,3 +187,49 @@ def test_pages_with_figures(snapshot):
     split_pages_dicts = [{"text": split_page.text, "page_num": split_page.page_num} for split_page in split_pages]
     split_pages_json = json.dumps(split_pages_dicts, indent=2)
     snapshot.assert_match(split_pages_json, "split_pages_with_figures.json")
+
+
+def test_excelsplitter_split_pages():
+    t = ExcelSplitter()
+    headers = ["Name", "Notes"]
+    columns = [["Alice", "Bob", "Carol"], ["first\nline", "a | b", ""], ["", "", "extra"]]
+
+    split_pages = list(t.split_pages(pages=[Page(page_num="Sheet1", offset=None, text=(headers, columns))]))
+    assert len(split_pages) == 1
+    assert split_pages[0].page_num == "Sheet1"
+    assert split_pages[0].text == (
+        "| Name | Notes |  |\n"
+        "| --- | --- | --- |\n"
+        "| Alice | first line |  |\n"
+        "| Bob | a \\| b |  |\n"
+        "| Carol |  | extra |"
+    )
+
+
+def test_excelsplitter_split_pages_in_chunks():
+    t = ExcelSplitter()
+    columns = [[str(i) for i in range(120)]]
+
+    split_pages = list(t.split_pages(pages=[Page(page_num="Sheet1", offset=None, text=(["n"], columns))]))
+    assert len(split_pages) == 3
+    for split_page in split_pages:
+        assert split_page.text.startswith("| n |\n| --- |\n")
+    assert split_pages[0].text.count("\n") == 51
+    assert split_pages[2].text.endswith("| 119 |")
+
+
+def test_excelsplitter_split_multiple_sheets():
+    t = ExcelSplitter()
+    pages = [Page(page_num=f"Sheet{i}", offset=None, text=(["n"], [[f"{i}-{j}" for j in range(60)]])) for i in range(3)]
+
+    split_pages = list(t.split_pages(pages=pages))
+    assert [split_page.page_num for split_page in split_pages] == [
+        "Sheet0",
+        "Sheet0",
+        "Sheet1",
+        "Sheet1",
+        "Sheet2",
+        "Sheet2",
+    ]
+    assert split_pages[0].text.endswith("| 0-49 |")
+    assert split_pages[5].text.endswith("| 2-59 |")